@@ -1,14 +1,16 @@
 import asyncio
-import json
 import os
 import re
 import shutil
-from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path, PurePosixPath
 from urllib.parse import urljoin, urlparse
 
 import uuid
-import aiohttp
-from bs4 import BeautifulSoup
+import aiofiles
+import httpx
+import orjson
+from bs4 import BeautifulSoup, SoupStrainer
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -30,6 +32,11 @@ TIMEOUT = 30  # <- total timeout per request (seconds)
 DOWNLOAD_SKIP_EXISTS = True  # <- skip downloads if file already exists
 CLEAN_BEFORE_RUN = True  # <- remove OUTPUT and IMAGES_DIR at startup
 
+# Compiled once; these run for every product/image in a run.
+_SLUG_KEEP = re.compile(r"[^\w\- ]+")
+_SLUG_WS = re.compile(r"\s+")
+_FNAME_BAD = re.compile(r"[^\w\.\-]+")
+
 
 def canonical_product_url(product_url: str) -> str:
     """
@@ -60,25 +67,22 @@ def slugify(text, fallback="product"):
     if not text:
         text = fallback
     text = " ".join(str(text).strip().split()).lower()
-    text = re.sub(r"[^\w\- ]+", "", text)
-    text = re.sub(r"\s+", "-", text).strip("-")
+    text = _SLUG_KEEP.sub("", text)
+    text = _SLUG_WS.sub("-", text).strip("-")
     return text or fallback
 
 
-def unique_folder(base_dir: Path, name: str) -> Path:
+def unique_folder(base_dir: Path, name: str, uid: str) -> Path:
     """
-    Return a unique folder path under base_dir for 'name' (append -1, -2, ... if needed).
+    Return a unique folder path under base_dir for 'name'. On collision,
+    append the first 8 chars of the product's UUID instead of probing
+    -1, -2, ... (one stat, deterministic, no race between coroutines).
     """
     base_dir.mkdir(parents=True, exist_ok=True)
     candidate = base_dir / name
     if not candidate.exists():
         return candidate
-    idx = 1
-    while True:
-        candidate = base_dir / f"{name}-{idx}"
-        if not candidate.exists():
-            return candidate
-        idx += 1
+    return base_dir / f"{name}-{uid[:8]}"
 
 
 def clean_outputs(output_file: str, images_dir: str):
@@ -100,20 +104,53 @@ def clean_outputs(output_file: str, images_dir: str):
         print(f"WARN: Failed to remove folder '{images_dir}': {e}")
 
 
-async def get_soup(url, session):
-    async with session.get(url) as resp:
-        resp.raise_for_status()
-        html = await resp.text()
-    return BeautifulSoup(html, "html.parser")
+# Only parse the product containers out of the catalog page. The class is
+# matched with a callable because themes emit multi-class containers
+# (e.g. "product-element-bottom extra") and an exact-string strainer would
+# drop them from the parsed tree entirely.
+CATALOG_STRAINER = SoupStrainer(
+    "div", class_=lambda c: bool(c) and "product-element-bottom" in c.split()
+)
+
+
+async def _raise_on_error(response):
+    # The hook fires for every response in a redirect chain, and
+    # raise_for_status() also raises on 3xx; only treat real errors as
+    # fatal so follow_redirects can do its job.
+    if response.status_code >= 400:
+        response.raise_for_status()
+
+
+async def get_html(url, session):
+    resp = await session.get(url)
+    return resp.text
+
+
+async def get_soup_catalog(url, session):
+    html = await get_html(url, session)
+    return BeautifulSoup(html, "lxml", parse_only=CATALOG_STRAINER)
+
+
+def parse_product_html(html, product_url):
+    """
+    Parse a product page from raw HTML. Module-level (and takes only
+    picklable arguments) so it can run inside a process pool worker.
+
+    No strainer here: the queried elements (description div, gallery
+    figures) sit deep in the page, so any strainer loose enough to keep
+    them would keep the whole document anyway.
+    """
+    soup = BeautifulSoup(html, "lxml")
+    return parse_product_details(soup, product_url)
 
 
 async def extract_product_links(catalog_url, session):
-    soup = await get_soup(catalog_url, session)
+    soup = await get_soup_catalog(catalog_url, session)
     links = set()
 
     # Find product links within each product element container
-    for div in soup.select("div.product-element-bottom"):
-        for a in div.select("a[href]"):
+    for div in soup.find_all("div", class_="product-element-bottom"):
+        for a in div.find_all("a", href=True):
             href = a.get("href")
             if not href:
                 continue
@@ -125,14 +162,15 @@ async def extract_product_links(catalog_url, session):
 
 
 def parse_product_details(soup, product_url):
-    title_el = soup.select_one("h1.product_title")
-    price_el = soup.select_one("p.price bdi")  # first bdi under p.price
-    desc_el = soup.select_one("div#tab-description")
+    title_el = soup.find("h1", class_="product_title")
+    price_p = soup.find("p", class_="price")
+    price_el = price_p.find("bdi") if price_p else None  # first bdi under p.price
+    desc_el = soup.find("div", id="tab-description")
 
     # Images: find anchor hrefs inside figure.woocommerce-product-gallery__image
     image_urls = []
-    for fig in soup.select("figure.woocommerce-product-gallery__image"):
-        a = fig.select_one("a[href]")
+    for fig in soup.find_all("figure", class_="woocommerce-product-gallery__image"):
+        a = fig.find("a", href=True)
         if a:
             href = a.get("href")
             if href:
@@ -158,56 +196,63 @@ def parse_product_details(soup, product_url):
     }
 
 
-async def fetch_product_details(product_url, session, sem):
-    async with sem:
-        try:
-            soup = await get_soup(product_url, session)
-            details = parse_product_details(soup, product_url)
-            if details.get("title"):
-                print(
-                    f"OK: {details.get('title')} | Price: {details.get('price')} | Images: {len(details.get('images', []))}"
-                )
-            else:
-                print(f"WARN: No title found -> {product_url}")
-            return details
-        except aiohttp.ClientResponseError as e:
-            print(f"HTTP error {e.status} -> {product_url}")
-        except aiohttp.ClientError as e:
-            print(f"Request error {e} -> {product_url}")
-        except Exception as e:
-            print(f"Unexpected error {e} -> {product_url}")
-        return None
+async def fetch_product_details(product_url, session, pool):
+    try:
+        html = await get_html(product_url, session)
+        # Parsing is CPU-bound and would hold the GIL inside the event loop;
+        # hand it to the process pool so parses run in parallel across cores.
+        loop = asyncio.get_running_loop()
+        details = await loop.run_in_executor(pool, parse_product_html, html, product_url)
+        if details.get("title"):
+            print(
+                f"OK: {details.get('title')} | Price: {details.get('price')} | Images: {len(details.get('images', []))}"
+            )
+        else:
+            print(f"WARN: No title found -> {product_url}")
+        return details
+    except httpx.HTTPStatusError as e:
+        print(f"HTTP error {e.response.status_code} -> {product_url}")
+    except httpx.HTTPError as e:
+        print(f"Request error {e} -> {product_url}")
+    except Exception as e:
+        print(f"Unexpected error {e} -> {product_url}")
+    return None
 
 
 def sanitize_filename_from_url(img_url: str, index: int):
     """
     Build a safe filename using the URL's basename; fallback to index with .jpg.
     """
-    path = urlparse(img_url).path
-    base = os.path.basename(path) or f"image-{index}.jpg"
-    base = re.sub(r"[^\w\.\-]+", "-", base)
-    return base
+    base = PurePosixPath(urlparse(img_url).path).name or f"image-{index}.jpg"
+    return _FNAME_BAD.sub("-", base)
 
 
 async def download_image(img_url, dest_path: Path, session, img_sem):
-    dest_path.parent.mkdir(parents=True, exist_ok=True)
+    # Caller creates the product folder once; no mkdir per image here
     if DOWNLOAD_SKIP_EXISTS and dest_path.exists():
         return dest_path
 
+    # Stream into a .part file and rename only on success, so an aborted
+    # transfer never leaves a truncated image that DOWNLOAD_SKIP_EXISTS
+    # would treat as complete on a later pass.
+    part_path = dest_path.with_name(dest_path.name + ".part")
     async with img_sem:
         try:
-            async with session.get(img_url) as resp:
-                resp.raise_for_status()
-                content = await resp.read()
-            with open(dest_path, "wb") as f:
-                f.write(content)
+            async with session.stream("GET", img_url) as resp:
+                # Stream to disk in fixed-size chunks instead of buffering the
+                # whole image in RAM and blocking the loop on a sync write.
+                async with aiofiles.open(part_path, "wb") as f:
+                    async for chunk in resp.aiter_bytes(256 * 1024):
+                        await f.write(chunk)
+            part_path.replace(dest_path)
             return dest_path
-        except aiohttp.ClientResponseError as e:
-            print(f"IMG HTTP {e.status} -> {img_url}")
-        except aiohttp.ClientError as e:
+        except httpx.HTTPStatusError as e:
+            print(f"IMG HTTP {e.response.status_code} -> {img_url}")
+        except httpx.HTTPError as e:
             print(f"IMG Request error {e} -> {img_url}")
         except Exception as e:
             print(f"IMG Unexpected error {e} -> {img_url}")
+        part_path.unlink(missing_ok=True)
         return None
 
 
@@ -218,13 +263,15 @@ async def download_images_for_product(product: dict, session, img_sem, base_dir:
     """
     title = product.get("title")
     url = product.get("url") or ""
-    fallback_name = slugify(
-        os.path.splitext(os.path.basename(urlparse(url).path))[0] or "product"
-    )
+    fallback_name = slugify(PurePosixPath(urlparse(url).path).stem or "product")
     folder_name = slugify(title, fallback=fallback_name)
-    product_dir = unique_folder(base_dir, folder_name)
+    uid = product.get("id") or product_unique_id(url)
+    product_dir = unique_folder(base_dir, folder_name, uid)
 
     image_urls = product.get("images", [])
+    if image_urls:
+        # One mkdir for the whole product instead of one per image
+        product_dir.mkdir(parents=True, exist_ok=True)
     tasks = []
     for i, img_url in enumerate(image_urls, start=1):
         fname = sanitize_filename_from_url(img_url, i)
@@ -232,51 +279,113 @@ async def download_images_for_product(product: dict, session, img_sem, base_dir:
         tasks.append(download_image(img_url, dest, session, img_sem))
 
     saved_paths = await asyncio.gather(*tasks)
-    rel_paths = [
-        str(Path(os.path.relpath(p, base_dir))) if p else None for p in saved_paths
-    ]
-    rel_paths = [p for p in rel_paths if p]
+    # Saved files always live under base_dir, so relative_to avoids the
+    # string round-trips of os.path.relpath
+    rel_paths = [str(p.relative_to(base_dir)) for p in saved_paths if p]
     product["image_files"] = rel_paths
     product["images_folder"] = str(product_dir.relative_to(base_dir))
     return product
 
 
+async def scrape_worker(queue, session, pool, img_sem, base_images_dir, out_f, state, lock):
+    """
+    Pull product URLs off the queue, fetch/parse each one, download its images
+    right away so disk I/O overlaps with the remaining page fetches, and
+    append the finished product to the output JSON array.
+    """
+    while True:
+        product_url = await queue.get()
+        try:
+            # A failure on one product (disk full, mkdir error, ...) must not
+            # kill the worker: a dead worker pool would deadlock queue.join()
+            try:
+                details = await fetch_product_details(product_url, session, pool)
+                if isinstance(details, dict) and details.get("title"):
+                    await download_images_for_product(
+                        details, session, img_sem, base_images_dir
+                    )
+                    async with lock:
+                        if state["count"]:
+                            out_f.write(b",\n")
+                        out_f.write(orjson.dumps(details))
+                        state["count"] += 1
+            except Exception as e:
+                print(f"WARN: Failed to process {product_url}: {e}")
+        finally:
+            queue.task_done()
+
+
 async def scrape_catalog():
     # Clean outputs before running
     if CLEAN_BEFORE_RUN:
         clean_outputs(OUTPUT, IMAGES_DIR)
 
-    timeout = aiohttp.ClientTimeout(total=TIMEOUT)
-    headers = {"User-Agent": USER_AGENT}
+    headers = {"User-Agent": USER_AGENT, "Accept-Encoding": "br, gzip"}
+    # Everything goes to one host: with HTTP/2 many in-flight requests
+    # multiplex over a couple of connections, so cap the pool at what the
+    # semaphores allow and keep connections alive across the whole run.
+    limits = httpx.Limits(
+        max_connections=CONCURRENCY + IMAGE_CONCURRENCY,
+        max_keepalive_connections=32,
+    )
 
     base_images_dir = Path(IMAGES_DIR)
     base_images_dir.mkdir(parents=True, exist_ok=True)
 
-    async with aiohttp.ClientSession(headers=headers, timeout=timeout) as session:
+    async with httpx.AsyncClient(
+        http2=True,
+        headers=headers,
+        limits=limits,
+        timeout=TIMEOUT,
+        follow_redirects=True,
+        event_hooks={"response": [_raise_on_error]},
+    ) as session:
         print("Loading catalog...")
         product_links = await extract_product_links(CATALOG_URL, session)
         print(f"Found {len(product_links)} candidate links")
+        print(f"Downloading images to '{base_images_dir}'...")
 
-        sem = asyncio.Semaphore(CONCURRENCY)
-        detail_tasks = [
-            fetch_product_details(url, session, sem) for url in product_links
-        ]
-        results = await asyncio.gather(*detail_tasks)
-
-        products = [r for r in results if isinstance(r, dict) and r.get("title")]
-
-        # Download images per product with separate concurrency limit
+        # Bounded producer/consumer pipeline: only ~CONCURRENCY pages (and
+        # their parsed soups) are in flight at once instead of one coroutine
+        # per link, and image downloads start as soon as a product is parsed.
+        queue = asyncio.Queue(maxsize=2 * CONCURRENCY)
         img_sem = asyncio.Semaphore(IMAGE_CONCURRENCY)
-        print(f"Downloading images to '{base_images_dir}'...")
-        dl_tasks = [
-            download_images_for_product(prod, session, img_sem, base_images_dir)
-            for prod in products
-        ]
-        products_with_images = await asyncio.gather(*dl_tasks)
-
-    with open(OUTPUT, "w", encoding="utf-8") as f:
-        json.dump(products_with_images, f, ensure_ascii=False, indent=2)
-    print(f"Saved {len(products_with_images)} products to {OUTPUT}")
+        state = {"count": 0}
+        lock = asyncio.Lock()
+        # Stream products into the JSON array as they finish instead of
+        # materializing the whole catalog in memory and dumping it at the end.
+        # Write to a temp file and rename once complete so the web app never
+        # sees a half-written (invalid) products.json.
+        tmp_output = OUTPUT + ".tmp"
+        with open(tmp_output, "wb") as out_f, ProcessPoolExecutor(
+            max_workers=os.cpu_count()
+        ) as pool:
+            out_f.write(b"[\n")
+            workers = [
+                asyncio.create_task(
+                    scrape_worker(
+                        queue,
+                        session,
+                        pool,
+                        img_sem,
+                        base_images_dir,
+                        out_f,
+                        state,
+                        lock,
+                    )
+                )
+                for _ in range(CONCURRENCY)
+            ]
+            for url in product_links:
+                await queue.put(url)
+            await queue.join()
+            for w in workers:
+                w.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            out_f.write(b"\n]\n")
+        os.replace(tmp_output, OUTPUT)
+
+    print(f"Saved {state['count']} products to {OUTPUT}")
     print("Done.")
 
 
@@ -1,9 +1,13 @@
+from functools import lru_cache
 from pathlib import Path
 from typing import List, Dict, Any, Optional
-import json
 import re
 from urllib.parse import quote_plus, unquote_plus
 
+import ahocorasick
+import numpy as np
+import orjson
+
 from fastapi import FastAPI, Request, HTTPException
 from fastapi.responses import HTMLResponse
 from fastapi.staticfiles import StaticFiles
@@ -16,6 +20,11 @@ MARGIN_CHOICES = [30, 40, 50, 60, 70, 80, 90, 100]
 PER_PAGE_DEFAULT = "20"
 PER_PAGE_CHOICES = ["20", "50", "100", "all"]
 
+# Compiled once; parse_price_info runs for every product on every load.
+# One scan finds both the first digit position and the full numeric run.
+_PRICE_RE = re.compile(r"(?P<num>[0-9][0-9\s.,]*[0-9]|[0-9])")
+_WS_COMPACT = re.compile(r"\s+")
+
 # FastAPI app
 app = FastAPI()
 
@@ -28,15 +37,44 @@ app.mount(
 # Templates
 templates = Jinja2Templates(directory="templates")
 
-# In-memory products
+# Rendered index pages keyed by (q, margin, page, per_page, products mtime).
+# The mtime in the key invalidates every entry when the cron writes a new
+# products.json; oldest entries are evicted once the cap is reached.
+_INDEX_CACHE: Dict[tuple, bytes] = {}
+_INDEX_CACHE_MAX = 256
+
+# In-memory products, reloaded only when products.json changes on disk
 PRODUCTS: List[Dict[str, Any]] = []
+TITLE_INDEX: Dict[str, Dict[str, Any]] = {}
+ID_INDEX: Dict[str, Dict[str, Any]] = {}
+_PRODUCTS_MTIME = 0.0
+
+
+def get_products() -> List[Dict[str, Any]]:
+    """Return the cached product list, reloading only when the file mtime moves.
+
+    products.json only changes when the cron run finishes, so per-request cost
+    is a single stat() instead of a full JSON parse.
+    """
+    global PRODUCTS, TITLE_INDEX, ID_INDEX, _PRODUCTS_MTIME
+    mtime = PRODUCTS_JSON_PATH.stat().st_mtime if PRODUCTS_JSON_PATH.exists() else -1.0
+    if mtime != _PRODUCTS_MTIME:
+        PRODUCTS = load_products()
+        TITLE_INDEX = {p["title"]: p for p in PRODUCTS if p.get("title")}
+        ID_INDEX = {p["id"]: p for p in PRODUCTS if p.get("id")}
+        _PRODUCTS_MTIME = mtime
+    return PRODUCTS
 
 
 def load_products() -> List[Dict[str, Any]]:
     if not PRODUCTS_JSON_PATH.exists():
         return []
-    with PRODUCTS_JSON_PATH.open("r", encoding="utf-8") as f:
-        data = json.load(f)
+    try:
+        data = orjson.loads(PRODUCTS_JSON_PATH.read_bytes())
+    except orjson.JSONDecodeError:
+        # A crashed scraper run can leave a malformed file behind; serve an
+        # empty catalog rather than failing every request
+        return []
     result = []
     for p in data:
         p = {
@@ -48,6 +86,20 @@ def load_products() -> List[Dict[str, Any]]:
             "image_files": p.get("image_files", []),
             "url": p.get("url"),
         }
+        # Lowercased once here so the search filter doesn't re-lower every
+        # title on every request
+        p["_title_lc"] = (p.get("title") or "").lower()
+        # Web image URLs never change after load; precompute them so the
+        # per-request accessors are plain dict reads
+        if p["image_files"]:
+            p["_img_urls"] = ["/images/" + f.replace("\\", "/") for f in p["image_files"]]
+        else:
+            p["_img_urls"] = p["images"] or []
+        p["_thumb"] = (
+            p["_img_urls"][0]
+            if p["_img_urls"]
+            else "https://via.placeholder.com/600x400?text=No+Image"
+        )
         parse_price_info(p)
         result.append(p)
     return result
@@ -81,23 +133,33 @@ CURRENCY_TOKENS = [
     "₡",
 ]
 
-
-def parse_price_info(product: Dict[str, Any]) -> None:
-    s = str(product.get("price") or "")
-    first_digits = re.search(r"\d", s)
-    token = ""
-    token_idx = -1
-    for t in CURRENCY_TOKENS:
-        idx = s.find(t)
-        if idx != -1 and (token_idx == -1 or idx < token_idx):
-            token, token_idx = t, idx
+# Multi-pattern automaton: finds every currency token in one pass over the
+# price string instead of one str.find per token.
+_CURRENCY_AC = ahocorasick.Automaton()
+for _t in CURRENCY_TOKENS:
+    _CURRENCY_AC.add_word(_t, _t)
+_CURRENCY_AC.make_automaton()
+
+
+@lru_cache(maxsize=4096)
+def _parse_price_cached(s: str) -> tuple:
+    """Parse a raw price string into (value, currency token, token position).
+
+    Cached because the same raw strings are re-parsed on every products.json
+    load; the catalog has far fewer distinct price strings than requests.
+    """
+    num_match = _PRICE_RE.search(s)
+    hits = [(end - len(tok) + 1, tok) for end, tok in _CURRENCY_AC.iter(s)]
+    if hits:
+        # Earliest occurrence wins; on ties prefer the longer token
+        token_idx, token = min(hits, key=lambda h: (h[0], -len(h[1])))
+    else:
+        token, token_idx = "", -1
     position = "prefix"
-    if token and first_digits:
-        position = "prefix" if token_idx <= first_digits.start() else "suffix"
+    if token and num_match:
+        position = "prefix" if token_idx <= num_match.start() else "suffix"
 
-    compact = re.sub(r"\s+", "", s)
-    num_match = re.search(r"[0-9\.,]+", compact)
-    num_str = num_match.group(0) if num_match else ""
+    num_str = _WS_COMPACT.sub("", num_match.group("num")) if num_match else ""
     if "," in num_str and "." in num_str:
         num_str = num_str.replace(",", "")
     elif "," in num_str and "." not in num_str:
@@ -111,16 +173,21 @@ def parse_price_info(product: Dict[str, Any]) -> None:
     except Exception:
         value = float("nan")
 
-    product["_priceValue"] = value
-    product["_currencySymbol"] = token
-    product["_currencyPosition"] = position
+    return value, token, position
+
+
+def parse_price_info(product: Dict[str, Any]) -> None:
+    (
+        product["_priceValue"],
+        product["_currencySymbol"],
+        product["_currencyPosition"],
+    ) = _parse_price_cached(str(product.get("price") or ""))
 
 
 def format_with_currency(value: float, product: Dict[str, Any]) -> str:
     if value is None or not (value == value):  # NaN check
         return str(product.get("price") or "")
     num_str = f"{value:,.2f}"
-    num_str = re.sub(r"(?<=\d),(?=\d{3}\b)", ",", num_str)
     sym = product.get("_currencySymbol") or ""
     position = product.get("_currencyPosition") or "prefix"
     return (
@@ -137,35 +204,19 @@ def compute_final_price_text(product: Dict[str, Any], margin: int) -> str:
 
 
 def product_thumbnail_url(product: Dict[str, Any]) -> str:
-    files = product.get("image_files") or []
-    if files:
-        return "/images/" + files[0].replace("\\", "/")
-    imgs = product.get("images") or []
-    if imgs:
-        return imgs[0]
-    return "https://via.placeholder.com/600x400?text=No+Image"
+    return product["_thumb"]
 
 
 def product_image_urls(product: Dict[str, Any]) -> List[str]:
-    files = product.get("image_files") or []
-    if files:
-        return ["/images/" + f.replace("\\", "/") for f in files]
-    imgs = product.get("images") or []
-    return imgs
+    return product["_img_urls"]
 
 
 def find_product_by_title(title: str) -> Optional[Dict[str, Any]]:
-    for p in PRODUCTS:
-        if (p.get("title") or "") == title:
-            return p
-    return None
+    return TITLE_INDEX.get(title)
 
 
 def find_product_by_id(pid: str) -> Optional[Dict[str, Any]]:
-    for p in PRODUCTS:
-        if (p.get("id") or "") == pid:
-            return p
-    return None
+    return ID_INDEX.get(pid)
 
 
 def resolve_page_size(per_page: str, total_items: int) -> int:
@@ -183,8 +234,7 @@ def resolve_page_size(per_page: str, total_items: int) -> int:
 
 @app.on_event("startup")
 def startup_event():
-    global PRODUCTS
-    PRODUCTS = load_products()
+    get_products()
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -200,10 +250,17 @@ async def index(
     if page < 1:
         page = 1
 
+    products = get_products()
+    cache_key = (q, margin, page, per_page, _PRODUCTS_MTIME)
+    cached = _INDEX_CACHE.get(cache_key)
+    if cached is not None:
+        return HTMLResponse(content=cached)
+
     q_norm = q.strip().lower()
-    global PRODUCTS
-    PRODUCTS = load_products()
-    filtered = [p for p in PRODUCTS if q_norm in (p.get("title") or "").lower()]
+    if q_norm:
+        filtered = [p for p in products if q_norm in p["_title_lc"]]
+    else:
+        filtered = products
 
     total = len(filtered)
     page_size = resolve_page_size(per_page, total)
@@ -225,16 +282,26 @@ async def index(
             end = start + page_size
             paged = filtered[start:end]
 
+    # q and per_page are the same for every item on the page; encode them once
+    q_enc = quote_plus(q)
+    pp_enc = quote_plus(per_page)
+    # Apply the margin to the whole page in one vectorized op instead of a
+    # Python multiply per item (NaNs pass through and fall back to the raw
+    # price string in format_with_currency)
+    base_vals = np.fromiter(
+        (p["_priceValue"] for p in paged), dtype=np.float64, count=len(paged)
+    )
+    final_vals = base_vals * (1.0 + margin / 100.0)
     items = []
-    for p in paged:
-        final_txt = compute_final_price_text(p, margin)
+    for p, final_val in zip(paged, final_vals):
+        final_txt = format_with_currency(float(final_val), p)
         items.append(
             {
                 "title": p.get("title"),
                 "thumbnail": product_thumbnail_url(p),
                 "final_price": final_txt,
                 # Use product ID here
-                "detail_href": f"/product?id={quote_plus(p.get('id') or '')}&margin={margin}&q={quote_plus(q)}&per_page={quote_plus(per_page)}",
+                "detail_href": f"/product?id={quote_plus(p.get('id') or '')}&margin={margin}&q={q_enc}&per_page={pp_enc}",
             }
         )
 
@@ -251,10 +318,10 @@ async def index(
         "page_size": page_size if page_size else total,
     }
 
-    return templates.TemplateResponse(
+    response = templates.TemplateResponse(
+        request,
         "index.html",
         {
-            "request": request,
             "items": items,
             "q": q,
             "margin": margin,
@@ -265,6 +332,10 @@ async def index(
             "pagination": pagination,
         },
     )
+    if len(_INDEX_CACHE) >= _INDEX_CACHE_MAX:
+        _INDEX_CACHE.pop(next(iter(_INDEX_CACHE)))
+    _INDEX_CACHE[cache_key] = response.body
+    return response
 
 
 @app.get("/product", response_class=HTMLResponse)
@@ -275,9 +346,8 @@ async def product_detail(
     q: str = "",
     per_page: str = PER_PAGE_DEFAULT,
 ):
-    # Reload products.json on every product detail request
-    global PRODUCTS
-    PRODUCTS = load_products()
+    # Pick up a fresh products.json if the cron has run since the last request
+    get_products()
 
     if margin not in MARGIN_CHOICES:
         margin = 30
@@ -295,9 +365,9 @@ async def product_detail(
     back_href = f"/?{back_params}"
 
     return templates.TemplateResponse(
+        request,
         "detail.html",
         {
-            "request": request,
             "product": {
                 "title": p.get("title"),
                 "description": p.get("description"),